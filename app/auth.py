@@ -1,3 +1,4 @@
+import hmac
 import os
 from fastapi import HTTPException, Security, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -5,9 +6,12 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 security = HTTPBearer()
 
 API_TOKEN = os.getenv("API_TOKEN", "change-me-please")
+# Cached once at import; compared with compare_digest so auth is constant
+# time and avoids per-request getenv + encode of the expected token.
+_API_TOKEN_B = API_TOKEN.encode()
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
-    if credentials.credentials != API_TOKEN:
+    if not hmac.compare_digest(credentials.credentials.encode(), _API_TOKEN_B):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication token",
@@ -1,48 +1,112 @@
 import asyncio
-import uuid
+import secrets
+import sys
 import time
 import re
-from typing import Dict, List, Optional
+
+import orjson
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional
 from dataclasses import dataclass, field
 from enum import Enum
 
+# Maximum log lines retained per job; older lines are evicted so a
+# multi-hour upgrade cannot grow the daemon's memory without bound.
+LOG_RING_SIZE = 10000
+
+# How long finished jobs stay queryable before being dropped from memory.
+JOB_RETENTION_SECONDS = 3600
+
+# Well-known systemd journal MESSAGE_IDs for unit lifecycle records
+# (see systemd.journal-fields(7) / catalog).
+UNIT_STOPPED_MESSAGE_ID = "9d1aaa27d60140bd96365438aad20286"
+UNIT_FAILED_MESSAGE_ID = "d9b373ed55a64feb8242e02dbe79a49c"
+
 class JobStatus(str, Enum):
     STARTED = "started"
     RUNNING = "running"
     SUCCESS = "success"
     FAILED = "failed"
 
-@dataclass
+@dataclass(slots=True)
 class Job:
     id: str
-    command: str
+    argv: List[str]
+    # Overrides the joined argv in API responses (e.g. masked secrets)
+    display_command: Optional[str] = None
     status: JobStatus = JobStatus.STARTED
     created_at: float = field(default_factory=time.time)
     finished_at: Optional[float] = None
     exit_code: Optional[int] = None
-    logs: List[str] = field(default_factory=list)
-    # Queues for active websocket listeners
-    listeners: List[asyncio.Queue] = field(default_factory=list)
+    logs: Deque[str] = field(default_factory=lambda: deque(maxlen=LOG_RING_SIZE))
+    # Total lines ever logged; lets readers resume by sequence number even
+    # after old lines have been evicted from the ring.
+    log_seq: int = 0
+    # Shared log buffer signalling: websocket readers keep their own sequence
+    # number and wake on `new_log_event` instead of each holding a queue.
+    new_log_event: asyncio.Event = field(default_factory=asyncio.Event)
+    done_event: asyncio.Event = field(default_factory=asyncio.Event)
+    # Lazily joined argv; slots=True rules out functools.cached_property
+    _command_cache: Optional[str] = field(default=None, repr=False)
 
-    async def add_log(self, line: str):
-        self.logs.append(line)
-        # Broadcast to all active listeners
-        for listener in self.listeners:
-            await listener.put(line)
+    @property
+    def command(self) -> str:
+        if self.display_command is not None:
+            return self.display_command
+        if self._command_cache is None:
+            self._command_cache = " ".join(self.argv)
+        return self._command_cache
 
-    def register_listener(self) -> asyncio.Queue:
-        q = asyncio.Queue()
-        self.listeners.append(q)
-        return q
+    def add_log(self, line: str):
+        self.logs.append(line)
+        self.log_seq += 1
+        self.new_log_event.set()
 
-    def remove_listener(self, q: asyncio.Queue):
-        if q in self.listeners:
-            self.listeners.remove(q)
+    def mark_done(self):
+        # Wake any readers blocked on new_log_event so they can observe done.
+        self.done_event.set()
+        self.new_log_event.set()
 
 class JobManager:
     def __init__(self):
         self.jobs: Dict[str, Job] = {}
 
+    def _schedule_cleanup(self, job_id: str):
+        """Drop a finished job after the retention window so completed jobs
+        don't accumulate in memory for the daemon's lifetime."""
+        asyncio.get_running_loop().call_later(
+            JOB_RETENTION_SECONDS, self.jobs.pop, job_id, None
+        )
+
+    @staticmethod
+    async def _iter_raw_lines(stream: asyncio.StreamReader) -> AsyncIterator[bytes]:
+        """Yield raw lines from a subprocess stream.
+
+        Reads in large chunks and splits on newlines locally instead of
+        calling StreamReader.readline per line, which rescans the buffer
+        for every feed and dominates chatty processes.
+        """
+        buf = bytearray()
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                break
+            buf.extend(chunk)
+            *lines, rest = buf.split(b"\n")
+            buf = bytearray(rest)
+            for raw in lines:
+                yield raw
+        # Flush whatever is left after EOF (no trailing newline)
+        if buf:
+            yield bytes(buf)
+
+    async def _iter_stdout_lines(self, stream: asyncio.StreamReader) -> AsyncIterator[str]:
+        """Yield decoded, sanitized, non-empty lines from a subprocess stream."""
+        async for raw in self._iter_raw_lines(stream):
+            decoded = self._sanitize_log_line(raw.decode(errors='replace').strip())
+            if decoded:
+                yield decoded
+
     @staticmethod
     def _sanitize_log_line(line: str) -> str:
         """Redact common credential tokens before storing/streaming logs."""
@@ -55,102 +119,117 @@ class JobManager:
         command: List[str],
         job_id: Optional[str] = None,
         display_command: Optional[str] = None,
-    ) -> str:
+        stdin_data: Optional[bytes] = None,
+    ) -> Job:
         if not job_id:
-            job_id = str(uuid.uuid4())
-        job = Job(id=job_id, command=display_command if display_command is not None else " ".join(command))
+            # token_hex is cheaper than str(uuid.uuid4()); interning the id
+            # lets later dict lookups hit the cached hash + pointer compare.
+            job_id = secrets.token_hex(16)
+        job_id = sys.intern(job_id)
+        job = Job(id=job_id, argv=command, display_command=display_command)
         self.jobs[job_id] = job
-        
+
         # Start background task to run the process
-        asyncio.create_task(self._run_process(job_id, command))
-        
-        return job_id
+        asyncio.create_task(self._run_process(job_id, command, stdin_data))
+
+        return job
 
     async def _monitor_detached_unit(self, job: Job, unit_name: str):
-        await job.add_log(f"Monitoring detached unit: {unit_name}")
-        
-        # Start journalctl to follow logs
-        journal_cmd = ["sudo", "journalctl", "-f", "-u", unit_name, "--no-tail"]
+        job.add_log(f"Monitoring detached unit: {unit_name}")
+
+        # One journalctl does everything: json output carries both the
+        # unit's log lines (MESSAGE) and systemd's own lifecycle records,
+        # so a single long-lived subprocess replaces the separate log
+        # follower, the is-active wait and the final systemctl show.
+        journal_cmd = ["sudo", "-n", "journalctl", "-o", "json", "-f", "-u", unit_name, "--no-tail"]
         journal_proc = await asyncio.create_subprocess_exec(
             *journal_cmd,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.STDOUT
         )
 
-        async def read_journal():
-            while True:
-                line = await journal_proc.stdout.readline()
-                if not line:
-                    break
-                decoded = self._sanitize_log_line(line.decode(errors='replace').strip())
+        final_status = "unknown"
+        result = "unknown"
+        exit_code = 0
+        saw_stop_record = False
+
+        async for raw in self._iter_raw_lines(journal_proc.stdout):
+            if not raw.strip():
+                continue
+            try:
+                entry = orjson.loads(raw)
+            except ValueError:
+                # journalctl warnings/errors arrive unstructured even in -o json mode
+                decoded = self._sanitize_log_line(raw.decode(errors='replace').strip())
+                if decoded:
+                    job.add_log(decoded)
+                continue
+
+            message = entry.get("MESSAGE")
+            if isinstance(message, str):
+                decoded = self._sanitize_log_line(message.strip())
                 if decoded:
-                    await job.add_log(decoded)
+                    job.add_log(decoded)
 
-        # Start reading logs in background
-        log_task = asyncio.create_task(read_journal())
+            # The main-process-exited record carries the service's exit status.
+            if "EXIT_STATUS" in entry:
+                try:
+                    exit_code = int(entry["EXIT_STATUS"])
+                except (TypeError, ValueError):
+                    pass
 
-        # Monitor service status
-        final_status = "unknown"
-        exit_code = 0
-        
-        while True:
-            await asyncio.sleep(2)
-            
-            # Check if active
-            check_cmd = ["sudo", "systemctl", "is-active", unit_name]
-            check_proc = await asyncio.create_subprocess_exec(
-                *check_cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, _ = await check_proc.communicate()
-            status = stdout.decode().strip()
-            
-            if status in ["inactive", "failed"]:
-                # Service finished
-                final_status = status
+            message_id = entry.get("MESSAGE_ID")
+            if message_id == UNIT_STOPPED_MESSAGE_ID:
+                final_status = "inactive"
+                result = entry.get("RESULT") or entry.get("JOB_RESULT") or "unknown"
+                saw_stop_record = True
                 break
-        
-        # Stop logging
+            if message_id == UNIT_FAILED_MESSAGE_ID:
+                final_status = "failed"
+                result = entry.get("RESULT") or "failed"
+                saw_stop_record = True
+                break
+
+        # Stop following the journal
         if journal_proc.returncode is None:
             journal_proc.terminate()
             try:
                 await asyncio.wait_for(journal_proc.wait(), timeout=5.0)
             except asyncio.TimeoutError:
                 journal_proc.kill()
-        
-        await log_task
 
-        # Get detailed exit status. Transient units can disappear quickly,
-        # so failure to read metadata should not force a failed job result.
-        result = "unknown"
-        show_stdout = b""
-        show_stderr = b""
-        show_cmd = ["sudo", "-n", "systemctl", "show", "-p", "ExecMainStatus,Result", "--value", unit_name]
-        try:
-            show_proc = await asyncio.create_subprocess_exec(
-                *show_cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            show_stdout, show_stderr = await show_proc.communicate()
-            if show_proc.returncode == 0:
-                lines = [line.strip() for line in show_stdout.decode(errors='replace').splitlines() if line.strip()]
-                if lines:
-                    try:
-                        exit_code = int(lines[0])
-                    except ValueError:
-                        exit_code = 0
-                    if len(lines) > 1:
-                        result = lines[1]
-            else:
-                await job.add_log(
-                    f"Warning: could not read final unit status for {unit_name}: "
-                    f"{show_stderr.decode(errors='replace').strip() or 'unknown error'}"
+        if not saw_stop_record:
+            # Journal stream ended without a lifecycle record (e.g. journalctl
+            # died); fall back to querying systemd directly. Transient units
+            # can disappear quickly, so failure to read metadata should not
+            # force a failed job result.
+            show_cmd = ["sudo", "-n", "systemctl", "show", "-p", "ActiveState,ExecMainStatus,Result", "--value", unit_name]
+            try:
+                show_proc = await asyncio.create_subprocess_exec(
+                    *show_cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
                 )
-        except Exception as e:
-            await job.add_log(f"Warning: error while reading final unit status for {unit_name}: {e!r}")
-            
+                show_stdout, show_stderr = await show_proc.communicate()
+                if show_proc.returncode == 0:
+                    lines = [line.strip() for line in show_stdout.decode(errors='replace').splitlines() if line.strip()]
+                    if lines:
+                        final_status = lines[0]
+                    if len(lines) > 1:
+                        try:
+                            exit_code = int(lines[1])
+                        except ValueError:
+                            exit_code = 0
+                    if len(lines) > 2:
+                        result = lines[2]
+                else:
+                    job.add_log(
+                        f"Warning: could not read final unit status for {unit_name}: "
+                        f"{show_stderr.decode(errors='replace').strip() or 'unknown error'}"
+                    )
+            except Exception as e:
+                job.add_log(f"Warning: error while reading final unit status for {unit_name}: {e!r}")
+
         job.exit_code = exit_code
         job.finished_at = time.time()
         
@@ -179,46 +258,48 @@ class JobManager:
         if not is_success and job.exit_code == 0:
             job.exit_code = 1
 
-        await job.add_log(
+        job.add_log(
             f"Final unit evaluation: is-active={final_status}, result={result}, exit_code={job.exit_code}"
         )
         
         job.status = JobStatus.SUCCESS if is_success else JobStatus.FAILED
         
-        for listener in job.listeners:
-            await listener.put(None)
+        job.mark_done()
+        self._schedule_cleanup(job.id)
 
-    async def _run_process(self, job_id: str, command: List[str]):
+    async def _run_process(self, job_id: str, command: List[str], stdin_data: Optional[bytes] = None):
         job = self.jobs.get(job_id)
         if not job:
             return
 
         job.status = JobStatus.RUNNING
         detached_unit = None
-        
+
         try:
             # Create subprocess
             process = await asyncio.create_subprocess_exec(
                 *command,
+                stdin=asyncio.subprocess.PIPE if stdin_data is not None else None,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.STDOUT 
+                stderr=asyncio.subprocess.STDOUT
             )
 
-            # Read output line by line
-            while True:
-                line = await process.stdout.readline()
-                if not line:
-                    break
-                # robust decoding used
-                decoded_line = self._sanitize_log_line(line.decode(errors='replace').strip())
-                if decoded_line: 
-                    await job.add_log(decoded_line)
-                    # Check for detachment
-                    if "Running as unit:" in decoded_line:
-                        # Extract unit name, e.g. "Running as unit: pins-sysupgrade-123.service"
-                        parts = decoded_line.split("Running as unit:")
-                        if len(parts) > 1:
-                            detached_unit = parts[1].strip()
+            # Secrets (e.g. wifi passwords) are handed over on stdin so they
+            # never appear in argv or the stored job command.
+            if stdin_data is not None:
+                process.stdin.write(stdin_data)
+                await process.stdin.drain()
+                process.stdin.close()
+
+            # Read output in chunks, splitting lines locally
+            async for decoded_line in self._iter_stdout_lines(process.stdout):
+                job.add_log(decoded_line)
+                # Check for detachment
+                if "Running as unit:" in decoded_line:
+                    # Extract unit name, e.g. "Running as unit: pins-sysupgrade-123.service"
+                    parts = decoded_line.split("Running as unit:")
+                    if len(parts) > 1:
+                        detached_unit = parts[1].strip()
 
             await process.wait()
             
@@ -231,21 +312,21 @@ class JobManager:
             job.finished_at = time.time()
             job.status = JobStatus.SUCCESS if job.exit_code == 0 else JobStatus.FAILED
             
-            # Notify listeners that job is done
-            for listener in job.listeners:
-                await listener.put(None)
+            # Notify readers that job is done
+            job.mark_done()
+            self._schedule_cleanup(job.id)
 
         except Exception as e:
             import traceback
             error_msg = f"Internal Error: {repr(e)}"
             print(f"Job failed with exception: {traceback.format_exc()}") # Print to server console for debugging
-            await job.add_log(error_msg)
+            job.add_log(error_msg)
             
             job.exit_code = -1
             job.status = JobStatus.FAILED
             job.finished_at = time.time()
-            for listener in job.listeners:
-                await listener.put(None)
+            job.mark_done()
+            self._schedule_cleanup(job.id)
 
     def get_job(self, job_id: str) -> Optional[Job]:
         return self.jobs.get(job_id)
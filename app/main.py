@@ -1,19 +1,23 @@
 import os
-import json
 import asyncio
-import uuid
+import hmac
+import importlib.util
+import secrets
+import sys
 import re
 from datetime import datetime
 from fastapi import FastAPI, Depends, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import Optional, List
 
+from . import auth
 from .auth import verify_token
-from .job_manager import job_manager, JobStatus
+from .job_manager import job_manager
 from .wifi_config import load_wifi_config, save_wifi_config
 
-app = FastAPI(title="System Update Daemon")
+app = FastAPI(title="System Update Daemon", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,6 +45,25 @@ WIFI_SCAN_SCRIPT_PATH = os.getenv("WIFI_SCAN_SCRIPT_PATH", DEFAULT_WIFI_SCAN)
 WIFI_CONNECT_SCRIPT_PATH = os.getenv("WIFI_CONNECT_SCRIPT_PATH", "/usr/local/bin/wifi-connect.sh")
 
 
+def _load_wifi_scan_module():
+    """Import wifi-scan.py in-process so /wifi/scan skips a python3 fork.
+
+    The file name has a hyphen (it doubles as a CLI script installed to
+    /usr/local/bin), so load it by path instead of a package import.
+    """
+    try:
+        spec = importlib.util.spec_from_file_location("wifi_scan", WIFI_SCAN_SCRIPT_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except Exception as e:
+        print(f"Could not import wifi scan module from {WIFI_SCAN_SCRIPT_PATH}: {e}")
+        return None
+
+
+_wifi_scan_module = _load_wifi_scan_module()
+
+
 class UpgradeRequest(BaseModel):
     dryRun: bool = False
 
@@ -90,22 +113,24 @@ class PiTemperatureResponse(BaseModel):
     fahrenheit: float
     source: str
 
-class JobResponse(BaseModel):
-
-    jobId: str
-    status: JobStatus
-    exitCode: Optional[int]
-    startedAt: float
-    finishedAt: Optional[float]
-    command: str
-
-@app.post("/upgrade", response_model=JobResponse, dependencies=[Depends(verify_token)])
+def job_payload(job) -> dict:
+    """Plain-dict job response; skips the Pydantic validate-on-output pass."""
+    return {
+        "jobId": job.id,
+        "status": job.status.value,
+        "exitCode": job.exit_code,
+        "startedAt": job.created_at,
+        "finishedAt": job.finished_at,
+        "command": job.command,
+    }
+
+@app.post("/upgrade", dependencies=[Depends(verify_token)])
 async def trigger_upgrade(request: UpgradeRequest):
     """
     Triggers the system upgrade script.
     """
     # Create specific job ID to track the systemd unit
-    job_id = str(uuid.uuid4())
+    job_id = secrets.token_hex(16)
     
     # Construct command
     # Using 'sudo' + script path.
@@ -117,17 +142,9 @@ async def trigger_upgrade(request: UpgradeRequest):
         cmd.append("--dry-run")
 
     # Pass the pre-generated ID so job manager uses it
-    await job_manager.start_job(cmd, job_id=job_id)
-    job = job_manager.get_job(job_id)
+    job = await job_manager.start_job(cmd, job_id=job_id)
     
-    return JobResponse(
-        jobId=job.id,
-        status=job.status,
-        exitCode=job.exit_code,
-        startedAt=job.created_at,
-        finishedAt=job.finished_at,
-        command=job.command
-    )
+    return job_payload(job)
 
 
 @app.get("/samba", response_model=SambaStatus, dependencies=[Depends(verify_token)])
@@ -153,7 +170,7 @@ async def get_samba_status():
         return SambaStatus(enabled=False)
 
 
-@app.post("/samba", response_model=JobResponse, dependencies=[Depends(verify_token)])
+@app.post("/samba", dependencies=[Depends(verify_token)])
 async def trigger_samba(request: SambaRequest):
     """
     Enable or Disable Samba (SMB) Share.
@@ -161,17 +178,9 @@ async def trigger_samba(request: SambaRequest):
     action = "enable" if request.enable else "disable"
     cmd = ["sudo", "-n", SAMBA_SCRIPT_PATH, action]
     
-    job_id = await job_manager.start_job(cmd)
-    job = job_manager.get_job(job_id)
+    job = await job_manager.start_job(cmd)
     
-    return JobResponse(
-        jobId=job.id,
-        status=job.status,
-        exitCode=job.exit_code,
-        startedAt=job.created_at,
-        finishedAt=job.finished_at,
-        command=job.command
-    )
+    return job_payload(job)
 
 
 @app.get("/phd2", response_model=Phd2Status, dependencies=[Depends(verify_token)])
@@ -197,7 +206,7 @@ async def get_phd2_status():
     return Phd2Status(enabled=is_enabled, running=is_active)
 
 
-@app.post("/phd2", response_model=JobResponse, dependencies=[Depends(verify_token)])
+@app.post("/phd2", dependencies=[Depends(verify_token)])
 async def manage_phd2(request: Phd2Request):
     """
     Enable/Start or Disable/Stop PHD2 service.
@@ -209,33 +218,20 @@ async def manage_phd2(request: Phd2Request):
     # disable --now: disables and stops (if running)
     cmd = ["sudo", "-n", "systemctl", action, "--now", "phd2"]
     
-    job_id = await job_manager.start_job(cmd)
-    job = job_manager.get_job(job_id)
+    job = await job_manager.start_job(cmd)
     
-    return JobResponse(
-        jobId=job.id,
-        status=job.status,
-        exitCode=job.exit_code,
-        startedAt=job.created_at,
-        finishedAt=job.finished_at,
-        command=job.command
-    )
+    return job_payload(job)
 
 
-@app.get("/jobs/{job_id}", response_model=JobResponse, dependencies=[Depends(verify_token)])
+@app.get("/jobs/{job_id}", dependencies=[Depends(verify_token)])
 async def get_job_status(job_id: str):
-    job = job_manager.get_job(job_id)
+    # Interned at creation time, so intern the path parameter too for a
+    # cached-hash dict lookup.
+    job = job_manager.get_job(sys.intern(job_id))
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    return JobResponse(
-        jobId=job.id,
-        status=job.status,
-        exitCode=job.exit_code,
-        startedAt=job.created_at,
-        finishedAt=job.finished_at,
-        command=job.command
-    )
+    return job_payload(job)
 
 @app.websocket("/logs/{job_id}")
 async def websocket_logs(websocket: WebSocket, job_id: str):
@@ -244,41 +240,61 @@ async def websocket_logs(websocket: WebSocket, job_id: str):
     # Often tokens are passed in query param for WS: ?token=...
     # For simplicity here, we'll check query param.
     
-    token = websocket.query_params.get("token")
-    if token != os.getenv("API_TOKEN", "change-me-please"):
+    token = websocket.query_params.get("token", "")
+    if not hmac.compare_digest(token.encode(), auth._API_TOKEN_B):
         await websocket.close(code=1008) # Policy Violation
         return
 
-    job = job_manager.get_job(job_id)
+    job = job_manager.get_job(sys.intern(job_id))
     if not job:
         await websocket.close(code=1000, reason="Job not found")
         return
 
     await websocket.accept()
 
-    # 1. Send past logs
-    for line in job.logs:
-        await websocket.send_text(line)
+    def drain_since(seen_seq):
+        """Return (new_seq, lines) appended since seen_seq.
+
+        logs is a bounded ring, so if the reader fell more than the ring
+        size behind, only the retained tail is returned.
+        """
+        seq = job.log_seq
+        if seq <= seen_seq:
+            return seq, []
+        batch = list(job.logs)
+        missed = seq - seen_seq
+        if missed < len(batch):
+            batch = batch[-missed:]
+        return seq, batch
+
+    # 1. Send past logs as one newline-joined frame (clients split on \n)
+    idx, batch = drain_since(0)
+    if batch:
+        await websocket.send_text("\n".join(batch))
 
     # 2. If job is finished, close
     if job.finished_at is not None:
         await websocket.close()
         return
 
-    # 3. Listen for live logs
-    listener_queue = job.register_listener()
+    # 3. Listen for live logs: wake on the shared event and send everything
+    # appended since our last sequence number as a single frame instead of
+    # one frame per line.
     try:
-        while True:
-            line = await listener_queue.get()
-            if line is None:
-                # End of stream signal
-                break
-            await websocket.send_text(line)
+        while not job.done_event.is_set():
+            await job.new_log_event.wait()
+            job.new_log_event.clear()
+            idx, batch = drain_since(idx)
+            if batch:
+                await websocket.send_text("\n".join(batch))
+        # Flush lines that raced in before done_event was observed
+        idx, batch = drain_since(idx)
+        if batch:
+            await websocket.send_text("\n".join(batch))
     except WebSocketDisconnect:
         # Client disconnected
         pass
     finally:
-        job.remove_listener(listener_queue)
         # Only close if not already closed
         try:
             await websocket.close()
@@ -290,32 +306,14 @@ async def scan_wifi():
     """
     Scans for available WiFi networks.
     """
-    if not os.path.exists(WIFI_SCAN_SCRIPT_PATH):
-         raise HTTPException(status_code=500, detail=f"WiFi scan script not found at {WIFI_SCAN_SCRIPT_PATH}")
+    if _wifi_scan_module is None:
+         raise HTTPException(status_code=500, detail=f"WiFi scan module not available at {WIFI_SCAN_SCRIPT_PATH}")
 
     try:
-        # Run the python script
-        cmd = ["python3", WIFI_SCAN_SCRIPT_PATH]
-        
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await proc.communicate()
-        
-        if proc.returncode != 0:
-            error_details = stderr.decode()
-            print(f"WiFi scan error: {error_details}")
-            # Try to return partial results or empty list? 
-            # Or raise error. Let's raise error for now.
-            raise Exception(f"Script failed with code {proc.returncode}: {error_details}")
-            
-        output = stdout.decode().strip()
-        if not output:
-             return []
-        return json.loads(output)
-        
+        # The scan shells out to iwlist (blocking), so run it in a thread
+        # instead of forking a whole python3 interpreter per request.
+        return await asyncio.to_thread(_wifi_scan_module.get_wifi_networks)
+
     except Exception as e:
         import traceback
         traceback.print_exc() # Print full stack trace to logs
@@ -324,13 +322,16 @@ async def scan_wifi():
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/wifi/connect", response_model=JobResponse, dependencies=[Depends(verify_token)])
+@app.post("/wifi/connect", dependencies=[Depends(verify_token)])
 async def connect_wifi(request: WifiConnectRequest):
     """
     Connects to a WiFi network.
     This starts a background job to run the connection script.
     """
-    cmd = ["sudo", "-n", WIFI_CONNECT_SCRIPT_PATH, request.ssid, request.password or ""]
+    # The password travels over stdin (see wifi-connect.sh), never in argv,
+    # so it is not retained in the stored job command either. The empty
+    # placeholder keeps the script's positional arguments aligned.
+    cmd = ["sudo", "-n", WIFI_CONNECT_SCRIPT_PATH, request.ssid, ""]
     masked_cmd = ["sudo", "-n", WIFI_CONNECT_SCRIPT_PATH, request.ssid, "***" if request.password else ""]
     
     # Translate band to nmcli format if present
@@ -353,19 +354,13 @@ async def connect_wifi(request: WifiConnectRequest):
     # Check if script exists (only nice to have check, the job will fail if not found)
     # But locally on windows it's different path.
     
-    job_id = await job_manager.start_job(cmd, display_command=" ".join(masked_cmd))
-    job = job_manager.get_job(job_id)
-    if not job:
-        raise HTTPException(status_code=404, detail="Job not created")
-        
-    return JobResponse(
-        jobId=job.id,
-        status=job.status,
-        exitCode=job.exit_code,
-        startedAt=job.created_at,
-        finishedAt=job.finished_at,
-        command=job.command
+    job = await job_manager.start_job(
+        cmd,
+        display_command=" ".join(masked_cmd),
+        stdin_data=(request.password or "").encode(),
     )
+        
+    return job_payload(job)
 
 
 @app.get("/wifi/auto-connect", dependencies=[Depends(verify_token)])
@@ -508,7 +503,7 @@ async def get_system_time():
     )
 
 
-@app.post("/system/time", response_model=JobResponse, dependencies=[Depends(verify_token)])
+@app.post("/system/time", dependencies=[Depends(verify_token)])
 async def set_system_time(request: SystemTimeRequest):
     """
     Sets the system time using timedatectl (requires sudo).
@@ -532,16 +527,8 @@ async def set_system_time(request: SystemTimeRequest):
     # We use sudo timedatectl set-time "..."
     cmd = ["sudo", "-n", "timedatectl", "set-time", time_str]
     
-    job_id = await job_manager.start_job(cmd)
-    job = job_manager.get_job(job_id)
-
-    return JobResponse(
-        jobId=job.id,
-        status=job.status,
-        exitCode=job.exit_code,
-        startedAt=job.created_at,
-        finishedAt=job.finished_at,
-        command=job.command
-    )
+    job = await job_manager.start_job(cmd)
+
+    return job_payload(job)
 
 
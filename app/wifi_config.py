@@ -4,18 +4,29 @@ from typing import Optional, Dict, Any
 
 # In production this might be /etc/pins/wifi.json or similar
 # For now, we'll keep it in the app directory or relative to it.
-# Let's say we store it in the same directory as this file for simplicity, 
+# Let's say we store it in the same directory as this file for simplicity,
 # but in production it should be somewhere persistent.
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), "wifi_config.json")
 
+# Parsed config cached against the file's mtime so repeated reads cost a
+# single stat() instead of open + json.load per call.
+_cache = {"mtime": 0, "data": None}
+
 def load_wifi_config() -> Dict[str, Any]:
-    if not os.path.exists(CONFIG_FILE):
+    try:
+        st = os.stat(CONFIG_FILE)
+    except FileNotFoundError:
         return {"auto_connect": False, "ssid": None}
+    if st.st_mtime_ns == _cache["mtime"] and _cache["data"] is not None:
+        return _cache["data"]
     try:
         with open(CONFIG_FILE, 'r') as f:
-            return json.load(f)
+            data = json.load(f)
     except Exception:
         return {"auto_connect": False, "ssid": None, "band": None}
+    _cache["mtime"] = st.st_mtime_ns
+    _cache["data"] = data
+    return data
 
 def save_wifi_config(ssid: Optional[str], auto_connect: bool, band: Optional[str] = None):
     config = {
@@ -25,3 +36,5 @@ def save_wifi_config(ssid: Optional[str], auto_connect: bool, band: Optional[str
     }
     with open(CONFIG_FILE, 'w') as f:
         json.dump(config, f, indent=4)
+    # Force a re-read on the next load
+    _cache["mtime"] = 0
@@ -5,6 +5,41 @@ import sys
 import os
 import time
 
+# dbus-python ships with Raspberry Pi OS; when present we talk to
+# NetworkManager directly instead of shelling out to nmcli.
+try:
+    import dbus
+except ImportError:
+    dbus = None
+
+# orjson parses bytes directly and much faster than stdlib json; fall back
+# silently when running under a system python without it.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NM_BUS_NAME = "org.freedesktop.NetworkManager"
+NM_DEVICE_IFACE = "org.freedesktop.NetworkManager.Device"
+NM_WIRELESS_IFACE = "org.freedesktop.NetworkManager.Device.Wireless"
+NM_AP_IFACE = "org.freedesktop.NetworkManager.AccessPoint"
+DBUS_PROPS_IFACE = "org.freedesktop.DBus.Properties"
+NM_DEVICE_TYPE_WIFI = 2
+
+# How recent NetworkManager's own scan can be before we reuse its AP list
+# instead of requesting another sweep. NM scans periodically on its own;
+# a back-to-back RequestScan gets rejected ("Scanning not allowed
+# immediately following previous scan") and just stalls the radio.
+NM_SCAN_FRESH_SECONDS = 10.0
+
+# NM device states relevant to daemon mode (see NMDeviceState).
+NM_DEVICE_STATE_DISCONNECTED = 30
+NM_DEVICE_STATE_ACTIVATED = 100
+
+# How long daemon mode waits after a disconnect for a reconnect to land
+# before falling back to the hotspot.
+HOTSPOT_GRACE_SECONDS = 45
+
 # Configuration paths
 # Assuming this script is in /usr/local/bin or similar in production,
 # but for now we look for config relative to the app structure or in /etc/pins
@@ -17,31 +52,143 @@ CONFIG_PATHS = [
 
 WIFI_CONNECT_SCRIPT = os.path.join(os.path.dirname(__file__), "wifi-connect.sh")
 
+# Remembers which CONFIG_PATHS entry won, so a retried invocation (systemd
+# restarts this script on failure) opens the right file on the first try.
+CONFIG_PATH_HINT = "/run/pinsdaemon/wifi-config-path"
+
+def _config_search_order():
+    try:
+        with open(CONFIG_PATH_HINT, 'r') as f:
+            hint = f.read().strip()
+    except OSError:
+        return CONFIG_PATHS
+    if hint in CONFIG_PATHS:
+        return [hint] + [p for p in CONFIG_PATHS if p != hint]
+    return CONFIG_PATHS
+
+def _remember_config_path(path):
+    # Best effort; /run may be unavailable in dev.
+    try:
+        os.makedirs(os.path.dirname(CONFIG_PATH_HINT), exist_ok=True)
+        with open(CONFIG_PATH_HINT, 'w') as f:
+            f.write(path)
+    except OSError:
+        pass
+
 def load_config():
-    for path in CONFIG_PATHS:
-        if os.path.exists(path):
-            try:
-                with open(path, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading config from {path}: {e}")
+    # EAFP: open directly instead of stat-then-open per candidate.
+    for path in _config_search_order():
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            config = orjson.loads(data) if orjson is not None else json.loads(data)
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            print(f"Error loading config from {path}: {e}")
+            continue
+        _remember_config_path(path)
+        return config
     return None
 
-def scan_networks(ssid):
+# The system bus connection is shared across all D-Bus calls in this
+# process; opening one per call would redo the handshake each time.
+_system_bus = None
+
+def _get_system_bus():
+    global _system_bus
+    if _system_bus is None:
+        _system_bus = dbus.SystemBus()
+    return _system_bus
+
+# Wifi device proxies, resolved once per process and reused by every
+# D-Bus call so repeated scans skip the GetDevices/DeviceType walk.
+_wifi_devices = None
+
+def _get_wifi_devices():
+    global _wifi_devices
+    if _wifi_devices is None:
+        bus = _get_system_bus()
+        nm = bus.get_object(NM_BUS_NAME, "/org/freedesktop/NetworkManager")
+        _wifi_devices = []
+        for dev_path in nm.GetDevices(dbus_interface=NM_BUS_NAME):
+            dev = bus.get_object(NM_BUS_NAME, dev_path)
+            props = dbus.Interface(dev, DBUS_PROPS_IFACE)
+            if props.Get(NM_DEVICE_IFACE, "DeviceType") == NM_DEVICE_TYPE_WIFI:
+                _wifi_devices.append((props, dbus.Interface(dev, NM_WIRELESS_IFACE)))
+    return _wifi_devices
+
+def _scan_networks_dbus(ssid, timeout=10.0, poll_interval=0.2):
+    """Scan via NetworkManager's D-Bus API.
+
+    Reads the wifi device's LastScan timestamp, requests a scan, and waits
+    for LastScan to move before checking the AP list -- no fixed sleep and
+    no nmcli subprocesses (fork+exec of nmcli can pin a core on Pi Zero
+    class hardware; a D-Bus round-trip is sub-millisecond).
+    """
+    bus = _get_system_bus()
+    target = ssid.encode()
+
+    for props, wireless in _get_wifi_devices():
+        last_scan = props.Get(NM_WIRELESS_IFACE, "LastScan")
+
+        # LastScan is CLOCK_BOOTTIME in milliseconds (-1 = never scanned).
+        # When NM's own periodic scan just ran, its AP list is current --
+        # read it directly instead of racing NM with another RequestScan.
+        now_ms = time.clock_gettime(time.CLOCK_BOOTTIME) * 1000.0
+        if not (last_scan > 0 and now_ms - last_scan < NM_SCAN_FRESH_SECONDS * 1000.0):
+            try:
+                wireless.RequestScan({})
+            except dbus.exceptions.DBusException:
+                # Scan already in progress or not allowed right now; the
+                # LastScan wait below still covers the in-flight scan.
+                pass
+
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if props.Get(NM_WIRELESS_IFACE, "LastScan") != last_scan:
+                    break
+                time.sleep(poll_interval)
+
+        for ap_path in wireless.GetAccessPoints():
+            ap = bus.get_object(NM_BUS_NAME, ap_path)
+            ap_ssid = ap.Get(NM_AP_IFACE, "Ssid", dbus_interface=DBUS_PROPS_IFACE)
+            if bytes(bytearray(ap_ssid)) == target:
+                return True
+
+    return False
+
+def scan_networks(ssid, timeout=6.0, poll_interval=0.2):
+    if dbus is not None:
+        try:
+            return _scan_networks_dbus(ssid)
+        except Exception as e:
+            print(f"D-Bus scan failed, falling back to nmcli: {e}")
     try:
         # Force a scan
         subprocess.run(["nmcli", "device", "wifi", "rescan"], check=False)
-        time.sleep(3)
-        
-        # List networks
-        result = subprocess.run(
-            ["nmcli", "-t", "-f", "SSID", "device", "wifi", "list"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        available_ssids = result.stdout.strip().split('\n')
-        return ssid in available_ssids
+
+        # Poll the AP list instead of sleeping a flat 3 seconds; a fast scan
+        # returns as soon as the SSID shows up.
+        folded_target = ssid.casefold()
+        deadline = time.monotonic() + timeout
+        while True:
+            result = subprocess.run(
+                ["nmcli", "-t", "-f", "SSID", "device", "wifi", "list"],
+                capture_output=True,
+                check=True
+            )
+            available = frozenset(
+                s for s in result.stdout.decode(errors='replace').split('\n') if s
+            )
+            if ssid in available:
+                return True
+            # Some firmwares report vendor-cased SSIDs; retry case-insensitively
+            if any(s.casefold() == folded_target for s in available):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_interval)
     except subprocess.CalledProcessError as e:
         print(f"Error scanning networks: {e}")
         return False
@@ -62,21 +209,28 @@ def connect_to_wifi(ssid, band=None):
         print(f"Exception during connection: {e}")
         return False
 
-def start_hotspot():
+def start_hotspot(replace_process=True):
     print("Starting hotspot...")
-    try:
-        subprocess.run([WIFI_CONNECT_SCRIPT, "--hotspot"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to start hotspot: {e}")
-        sys.exit(1)
+    if replace_process:
+        # In one-shot mode this is the script's terminal action, so replace
+        # the process image with the helper instead of forking it and idling
+        # in Python for the hotspot's startup window. The exit status
+        # becomes the helper's.
+        sys.stdout.flush()
+        try:
+            os.execv(WIFI_CONNECT_SCRIPT, [WIFI_CONNECT_SCRIPT, "--hotspot"])
+        except OSError as e:
+            print(f"Failed to start hotspot: {e}")
+            sys.exit(1)
+    # Daemon mode stays alive to keep reacting to state changes.
+    result = subprocess.run([WIFI_CONNECT_SCRIPT, "--hotspot"])
+    return result.returncode == 0
 
-def main():
-    config = load_config()
-    
+def _attempt_auto_connect(config):
+    """Scan for and connect to the configured network. True on success."""
     if not config:
         print("No wifi configuration found.")
-        start_hotspot()
-        return
+        return False
 
     ssid = config.get("ssid")
     auto_connect = config.get("auto_connect", False)
@@ -87,16 +241,104 @@ def main():
         if scan_networks(ssid):
             print(f"Network {ssid} found.")
             if connect_to_wifi(ssid, band):
-                 sys.exit(0)
-            else:
-                 print("Connection failed.")
+                return True
+            print("Connection failed.")
         else:
             print(f"Network {ssid} not found in scan results.")
     else:
         print("Auto-connect disabled or SSID not configured.")
+    return False
+
+def run_daemon():
+    """Stay resident and react to NetworkManager device state changes.
+
+    One-shot invocation repays interpreter startup, config discovery and
+    the D-Bus handshake on every retry; as a daemon those are paid once
+    and reconnects become edge-triggered StateChanged callbacks instead
+    of a systemd restart loop.
+    """
+    try:
+        from dbus.mainloop.glib import DBusGMainLoop
+        from gi.repository import GLib
+    except ImportError as e:
+        print(f"Daemon mode unavailable ({e}); running one-shot instead.")
+        main()
+        return
+
+    global _system_bus, _wifi_devices
+    # The bus must be created after the GLib main loop is the default for
+    # signal delivery to work; drop anything cached before that.
+    DBusGMainLoop(set_as_default=True)
+    _system_bus = None
+    _wifi_devices = None
+    bus = _get_system_bus()
+
+    loop = GLib.MainLoop()
+    watchdog = {"source": None}
+
+    def disarm_watchdog():
+        if watchdog["source"] is not None:
+            GLib.source_remove(watchdog["source"])
+            watchdog["source"] = None
+
+    def on_watchdog():
+        watchdog["source"] = None
+        print(f"No connection after {HOTSPOT_GRACE_SECONDS}s; falling back to hotspot.")
+        start_hotspot(replace_process=False)
+        return False  # one-shot timer
+
+    def arm_watchdog():
+        if watchdog["source"] is None:
+            watchdog["source"] = GLib.timeout_add_seconds(HOTSPOT_GRACE_SECONDS, on_watchdog)
+
+    def try_reconnect():
+        if _attempt_auto_connect(load_config()):
+            disarm_watchdog()
+        else:
+            arm_watchdog()
+
+    def on_state_changed(new_state, old_state, reason):
+        state = int(new_state)
+        if state == NM_DEVICE_STATE_ACTIVATED:
+            disarm_watchdog()
+        elif state == NM_DEVICE_STATE_DISCONNECTED:
+            print("Device disconnected; attempting reconnect.")
+            try_reconnect()
+
+    bus.add_signal_receiver(
+        on_state_changed,
+        signal_name="StateChanged",
+        dbus_interface=NM_DEVICE_IFACE,
+        bus_name=NM_BUS_NAME,
+    )
+
+    # Cover whatever state the box booted in before the first signal.
+    try_reconnect()
+    loop.run()
+
+def main():
+    config = load_config()
+
+    # Freshly provisioned devices have no config (or auto-connect off):
+    # exec straight to the hotspot without touching any of the scan
+    # machinery or spawning a single subprocess first.
+    if not config:
+        print("No wifi configuration found.")
+        start_hotspot()
+        return
+    if not (config.get("auto_connect") and config.get("ssid")):
+        print("Auto-connect disabled or SSID not configured.")
+        start_hotspot()
+        return
+
+    if _attempt_auto_connect(config):
+        sys.exit(0)
 
     # Fallback to hotspot
     start_hotspot()
 
 if __name__ == "__main__":
-    main()
+    if "--daemon" in sys.argv:
+        run_daemon()
+    else:
+        main()
@@ -4,6 +4,12 @@ SSID="$1"
 PASSWORD="$2"
 BAND="$3" # "a" for 5GHz, "bg" for 2.4GHz
 
+# The daemon pipes the password on stdin so it never shows up in argv or
+# process listings; the positional argument remains for manual invocation.
+if [ -z "$PASSWORD" ] && [ ! -t 0 ]; then
+    IFS= read -r PASSWORD || true
+fi
+
 # Support for explicit hotspot mode
 if [ "$1" == "--hotspot" ]; then
     FORCE_HOTSPOT=true
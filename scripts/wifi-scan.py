@@ -1,91 +1,409 @@
 #!/usr/bin/env python3
+import os
 import subprocess
 import re
 import json
 import sys
 import shutil
+import tempfile
+import time
 
-def get_wifi_networks():
-    wifi_networks = []
-    
-    # Check if nmcli is available
-    # Removed nmcli code block as it was incomplete and iwlist is preferred for this device.
-    # if shutil.which("nmcli"): ... 
-            
-    # Fallback to iwlist (more reliable for raw scanning on Pi)
-    # The user explicitly uses iwlist, so we prioritize it or use it exclusively if reliable.
+# orjson serializes bytes directly and several times faster than stdlib
+# json; fall back silently when running under a system python without it.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# On-disk scan cache: repeated calls within the TTL return the cached
+# result instead of re-driving a multi-second iwlist scan (which can also
+# destabilize the Pi wifi driver under rapid repetition). 30 s matches
+# NetworkManager's own refresh cadence.
+CACHE_PATH = os.environ.get("WIFI_SCAN_CACHE_PATH", "/run/pinsdaemon/wifi-scan.json")
+CACHE_TTL = 30.0
+
+# Resolved once at import; binary locations never change during the
+# process lifetime, so don't re-walk PATH per scan.
+IWLIST_PATH = (
+    shutil.which("/sbin/iwlist")
+    or shutil.which("/usr/sbin/iwlist")
+    or shutil.which("iwlist")
+    or "iwlist"
+)
+WPA_CLI_PATH = shutil.which("wpa_cli")
+IW_PATH = shutil.which("iw")
+
+# Backend autoselect: wpa_cli and iw speak nl80211 directly and return
+# results much faster than the deprecated iwlist ioctl path; iwlist stays
+# as the final fallback.
+if WPA_CLI_PATH:
+    SCAN_BACKEND = "wpa_cli"
+elif IW_PATH:
+    SCAN_BACKEND = "iw"
+else:
+    SCAN_BACKEND = "iwlist"
+
+GETCAP_PATH = shutil.which("getcap")
+_WPA_CTRL_DIR = "/var/run/wpa_supplicant"
+
+def _sudo_prefix(binary):
+    """['sudo'] unless the tool can run directly.
+
+    Every sudo invocation re-reads sudoers and runs PAM -- tens of ms per
+    scan on a Pi. The package postinst grants cap_net_admin/cap_net_raw
+    to the scan tools, so detect that once at import and skip sudo.
+    """
+    if os.geteuid() == 0:
+        return []
+    if binary and GETCAP_PATH:
+        try:
+            out = subprocess.run(
+                [GETCAP_PATH, binary], capture_output=True, text=True
+            ).stdout
+            if "cap_net_admin" in out:
+                return []
+        except OSError:
+            pass
+    return ["sudo"]
+
+def _wpa_cli_prefix():
+    # wpa_cli needs no capabilities, just access to wpa_supplicant's
+    # control socket (granted via netdev group membership in postinst).
+    if os.geteuid() == 0 or os.access(_WPA_CTRL_DIR, os.R_OK | os.X_OK):
+        return []
+    return ["sudo"]
+
+IWLIST_SUDO = _sudo_prefix(IWLIST_PATH)
+IW_SUDO = _sudo_prefix(IW_PATH)
+WPA_CLI_SUDO = _wpa_cli_prefix()
+
+def _read_cache():
+    try:
+        if time.time() - os.path.getmtime(CACHE_PATH) < CACHE_TTL:
+            with open(CACHE_PATH, 'rb') as f:
+                data = f.read()
+            return orjson.loads(data) if orjson is not None else json.loads(data)
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _write_cache(networks):
+    # Best effort: /run may not exist or be writable in dev environments.
+    try:
+        cache_dir = os.path.dirname(CACHE_PATH)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            if orjson is not None:
+                f.write(orjson.dumps(networks))
+            else:
+                f.write(json.dumps(networks).encode())
+        os.replace(tmp, CACHE_PATH)
+    except OSError:
+        pass
+
+def _wireless_interfaces():
+    """Wireless NICs from sysfs -- cheaper than parsing nmcli device."""
     try:
-        # Determine iwlist path
-        iwlist_path = "iwlist"
-        if shutil.which("/sbin/iwlist"):
-            iwlist_path = "/sbin/iwlist"
-        elif shutil.which("/usr/sbin/iwlist"):
-            iwlist_path = "/usr/sbin/iwlist"
-            
-        cmd = ["sudo", iwlist_path, "wlan0", "scan"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            # Try just 'iwlist scan' (might find other interfaces)
-            cmd = ["sudo", iwlist_path, "scan"]
-
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
+        return [
+            name for name in os.listdir("/sys/class/net")
+            if os.path.isdir(os.path.join("/sys/class/net", name, "wireless"))
+        ]
+    except OSError:
+        return []
+
+_CELL_SPLIT_RE = re.compile(r"\n(?=\s*Cell \d+ )")
+
+# All iwlist fields as one alternation, so a cell block is scanned once
+# in re's C matcher instead of seven separate searches. An alternation
+# (rather than one .*?-chained pattern) keeps it order-independent and
+# tolerant of fields some drivers omit.
+_FIELD_RE = re.compile(
+    r"Address:\s*(?P<mac>[0-9A-Fa-f:]{17})"
+    r'|ESSID:"(?P<ssid>[^"]*)"'
+    r"|Channel:(?P<channel>\d+)"
+    r"|Frequency:(?P<freq>[\d.]+)\s*GHz"
+    r"|Quality=(?P<q_num>\d+)/(?P<q_den>\d+)"
+    r"|Signal level=(?P<signal>-?\d+)"
+    r"|Encryption key:(?P<enc>on|off)"
+)
+
+def _parse_iwlist_cell(block):
+    net = {}
+    for match in _FIELD_RE.finditer(block):
+        # lastgroup names the alternative that matched (q_den for the
+        # two-group quality branch).
+        group = match.lastgroup
+        if group == 'mac':
+            net['mac'] = sys.intern(match.group('mac').upper())
+        elif group == 'ssid':
+            net['ssid'] = sys.intern(match.group('ssid'))
+        elif group == 'channel':
+            net['channel'] = int(match.group('channel'))
+        elif group == 'freq':
+            net['frequency'] = float(match.group('freq'))
+        elif group == 'q_den':
+            net['quality'] = f"{match.group('q_num')}/{match.group('q_den')}"
+        elif group == 'signal':
+            net['signal_strength'] = int(match.group('signal'))
+        elif group == 'enc':
+            net['encrypted'] = (match.group('enc') == "on")
+    return net
+
+def _iter_iwlist_cells(stream):
+    """Yield parsed cells as iwlist emits them.
+
+    Parsing overlaps with the driver delivering scan results and avoids
+    holding the whole stdout buffer before the first cell is handled.
+    """
+    block_lines = None
+    for line in stream:
+        if line.lstrip().startswith("Cell"):
+            if block_lines:
+                net = _parse_iwlist_cell("".join(block_lines))
+                if net:
+                    yield net
+            block_lines = []
+        if block_lines is not None:
+            block_lines.append(line)
+    if block_lines:
+        net = _parse_iwlist_cell("".join(block_lines))
+        if net:
+            yield net
+
+def _parse_iwlist_output(content):
+    networks = []
+    for block in _CELL_SPLIT_RE.split(content):
+        if not block.lstrip().startswith("Cell"):
+            # Preamble like "wlan0  Scan completed :"
+            continue
+        net = _parse_iwlist_cell(block)
+        if net:
+            networks.append(net)
+    return networks
+
+def _parse_wpa_cli_results(content):
+    # Tab-delimited: bssid / frequency / signal level / flags / ssid.
+    # No regex needed; the header line has no tabs and is skipped by the
+    # field-count check.
+    networks = []
+    for line in content.splitlines():
+        parts = line.split('\t')
+        if len(parts) < 5:
+            continue
+        bssid, freq, signal, flags, ssid = parts[:5]
+        try:
+            net = {
+                'mac': sys.intern(bssid.upper()),
+                'frequency': round(int(freq) / 1000.0, 3),
+                'signal_strength': int(signal),
+                'encrypted': ("WPA" in flags or "WEP" in flags),
+                'ssid': sys.intern(ssid),
+            }
+        except ValueError:
+            continue
+        networks.append(net)
+    return networks
+
+def _parse_iw_output(content):
+    networks = []
+    net = None
+    for line in content.splitlines():
+        stripped = line.strip()
+        if line.startswith("BSS "):
+            if net:
+                networks.append(net)
+            net = {'mac': sys.intern(stripped[4:].split("(")[0].strip().upper())}
+        elif net is None:
+            continue
+        elif stripped.startswith("freq:"):
+            try:
+                net['frequency'] = round(float(stripped.split(":", 1)[1]) / 1000.0, 3)
+            except ValueError:
+                pass
+        elif stripped.startswith("signal:"):
+            match = re.search(r"-?\d+", stripped)
+            if match:
+                net['signal_strength'] = int(match.group(0))
+        elif stripped.startswith("SSID:"):
+            net['ssid'] = sys.intern(stripped[5:].strip())
+        elif stripped.startswith("capability:"):
+            net['encrypted'] = "Privacy" in stripped
+        elif stripped.startswith("DS Parameter set: channel"):
+            try:
+                net['channel'] = int(stripped.rsplit(" ", 1)[1])
+            except ValueError:
+                pass
+    if net:
+        networks.append(net)
+    return networks
+
+def _merge_networks(networks):
+    """Dedupe by SSID across interfaces, keeping the strongest signal."""
+    merged = {}
+    hidden = []
+    for net in networks:
+        ssid = net.get('ssid')
+        if not ssid:
+            hidden.append(net)
+            continue
+        best = merged.get(ssid)
+        if best is None or net.get('signal_strength', -1000) > best.get('signal_strength', -1000):
+            merged[ssid] = net
+    return list(merged.values()) + hidden
+
+def trigger_scan(interfaces=None):
+    """Kick off a background scan without waiting for results.
+
+    nl80211 decouples triggering a scan from reading results, so callers
+    (e.g. a systemd timer) can request a refresh cheaply and let
+    get_wifi_networks() read the kernel's cached table later.
+    """
+    if interfaces is None:
+        interfaces = _wireless_interfaces() or ["wlan0"]
+    if SCAN_BACKEND == "wpa_cli":
+        cmd = lambda iface: WPA_CLI_SUDO + [WPA_CLI_PATH, "-i", iface, "scan"]
+    elif SCAN_BACKEND == "iw":
+        cmd = lambda iface: IW_SUDO + [IW_PATH, "dev", iface, "scan", "trigger"]
+    else:
+        # iwlist has no trigger-only mode; its scan ioctl refreshes the
+        # driver cache as a side effect, so just discard the output.
+        cmd = lambda iface: IWLIST_SUDO + [IWLIST_PATH, iface, "scan"]
+    for iface in interfaces:
+        subprocess.run(
+            cmd(iface),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+def _scan_wpa_cli(interfaces, rescan=False):
+    # scan_results reads wpa_supplicant's cached table and returns
+    # immediately; only trigger fresh scans when the caller asked for them.
+    if rescan:
+        for iface in interfaces:
+            subprocess.run(
+                WPA_CLI_SUDO + [WPA_CLI_PATH, "-i", iface, "scan"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+    networks = []
+    any_ok = False
+    for iface in interfaces:
+        result = subprocess.run(
+            WPA_CLI_SUDO + [WPA_CLI_PATH, "-i", iface, "scan_results"],
+            capture_output=True,
+            text=True,
+        )
         if result.returncode == 0:
-            content = result.stdout
-            networks = []
-            current_network = {}
-            
-            for line in content.splitlines():
-                line = line.strip()
-                if line.startswith("Cell"):
-                    if current_network:
-                        networks.append(current_network)
-                    current_network = {}
-                    # Cell 01 - Address: XX:XX...
-                    match = re.search(r"Address:\s*([0-9A-F:]{17})", line, re.IGNORECASE)
-                    if match:
-                        current_network['mac'] = match.group(1)
-                elif line.startswith("ESSID:"):
-                    ssid = line.split(":", 1)[1].strip('"')
-                    current_network['ssid'] = ssid
-                elif line.startswith("Channel:"):
-                    try:
-                        current_network['channel'] = int(line.split(":")[1])
-                    except ValueError:
-                        pass
-                elif line.startswith("Frequency:"):
-                    # Frequency:2.417 GHz (Channel 2)
-                    match = re.search(r"Frequency:([\d\.]+)\s*GHz", line)
-                    if match:
-                        current_network['frequency'] = float(match.group(1))
-                elif "Signal level" in line:
-                    # Quality=XX/XX Signal level=-XX dBm
-                    match = re.search(r"Signal level=([-\d]+)", line)
-                    if match:
-                        current_network['signal_strength'] = int(match.group(1))
-                    
-                    match_quality = re.search(r"Quality=([\d]+)/([\d]+)", line)
-                    if match_quality:
-                        current_network['quality'] = f"{match_quality.group(1)}/{match_quality.group(2)}"
-                elif line.startswith("Encryption key:"):
-                    current_network['encrypted'] = (line.split(":")[1] == "on")
-                
-            if current_network:
-                networks.append(current_network)
-            
-            return networks
-            
-    except Exception as e:
-        print(json.dumps({"error": str(e)}))
-        sys.exit(1)
-        
-    return []
+            any_ok = True
+            networks.extend(_parse_wpa_cli_results(result.stdout))
+    return networks, any_ok
+
+def _scan_iw(interfaces, rescan=False):
+    # 'scan dump' returns the kernel-cached BSS table in milliseconds;
+    # a full 'scan' blocks for the multi-second sweep and is only worth
+    # it when the caller explicitly wants fresh results.
+    iw_args = ["scan"] if rescan else ["scan", "dump"]
+    procs = [
+        subprocess.Popen(
+            IW_SUDO + [IW_PATH, "dev", iface] + iw_args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        for iface in interfaces
+    ]
+    networks = []
+    any_ok = False
+    for proc in procs:
+        stdout, _ = proc.communicate()
+        if proc.returncode == 0:
+            any_ok = True
+            networks.extend(_parse_iw_output(stdout))
+    return networks, any_ok
+
+def _scan_iwlist(interfaces):
+    # Kick off one scan per radio before reading any of them, so an internal
+    # card and a USB dongle scan concurrently instead of back to back.
+    procs = [
+        subprocess.Popen(
+            IWLIST_SUDO + [IWLIST_PATH, iface, "scan"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+        )
+        for iface in interfaces
+    ]
+
+    networks = []
+    any_ok = False
+    for proc in procs:
+        # Parse cells incrementally off the pipe rather than buffering the
+        # whole scan output first.
+        networks.extend(_iter_iwlist_cells(proc.stdout))
+        proc.stdout.close()
+        if proc.wait() == 0:
+            any_ok = True
+
+    if not any_ok:
+        # Try just 'iwlist scan' (lets iwlist pick the interfaces itself)
+        result = subprocess.run(IWLIST_SUDO + [IWLIST_PATH, "scan"], capture_output=True, text=True)
+        if result.returncode == 0:
+            return _parse_iwlist_output(result.stdout), True
+
+    return networks, any_ok
+
+def get_wifi_networks(rescan=False):
+    if not rescan:
+        cached = _read_cache()
+        if cached is not None:
+            return cached
+
+    # Errors propagate to the caller: the CLI wrapper below reports them as
+    # JSON, and importing callers (the daemon) handle them directly.
+    interfaces = _wireless_interfaces() or ["wlan0"]
+
+    networks = []
+    any_ok = False
+    if SCAN_BACKEND == "wpa_cli":
+        networks, any_ok = _scan_wpa_cli(interfaces, rescan=rescan)
+    elif SCAN_BACKEND == "iw":
+        networks, any_ok = _scan_iw(interfaces, rescan=rescan)
+
+    if not networks:
+        # Deprecated but dependable on Pi hardware; also the last resort
+        # when wpa_supplicant isn't reachable or iw isn't installed.
+        iwlist_networks, iwlist_ok = _scan_iwlist(interfaces)
+        if iwlist_networks or not any_ok:
+            networks, any_ok = iwlist_networks, iwlist_ok
+
+    if not any_ok and not networks:
+        return []
+
+    networks = _merge_networks(networks)
+    _write_cache(networks)
+    return networks
+
+def _dump(obj):
+    if orjson is not None:
+        sys.stdout.buffer.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+        sys.stdout.buffer.write(b"\n")
+    else:
+        # Stream-encode instead of materializing one big string
+        for chunk in json.JSONEncoder(indent=2).iterencode(obj):
+            sys.stdout.write(chunk)
+        sys.stdout.write("\n")
 
 if __name__ == "__main__":
+    if "--trigger" in sys.argv:
+        # Fire-and-forget refresh (e.g. from a systemd timer); the next
+        # normal invocation reads the refreshed kernel/supplicant cache.
+        trigger_scan()
+        sys.exit(0)
     try:
-        networks = get_wifi_networks()
-        print(json.dumps(networks, indent=2))
+        networks = get_wifi_networks(rescan="--rescan" in sys.argv)
+        _dump(networks)
     except Exception as e:
-        print(json.dumps({"error": str(e)}))
+        _dump({"error": str(e)})
         sys.exit(1)